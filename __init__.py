@@ -1,13 +1,12 @@
 """
 Package initialization to ensure fastapi_proxy is loaded.
-This ensures the import hook is registered even if fastapi_proxy
-isn't explicitly imported.
+This only patches model_app if it is already importable; the model script
+should still call fastapi_proxy.patch_make_model_app() itself.
 """
-# Import fastapi_proxy to register the import hook
+# Import fastapi_proxy to patch model_app.make_model_app if possible
 try:
     import fastapi_proxy
 except ImportError:
     # If fastapi_proxy can't be imported, that's okay
-    # The import hook will still work if fastapi_proxy is imported later
+    # The model script can still import fastapi_proxy directly
     pass
-
@@ -8,25 +8,59 @@ Following Domino's recommended approach for FastAPI apps with multiple endpoints
 """
 
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from typing import Dict, Any, Optional
-import requests
+import anyio.to_thread
+import httpx
+import msgspec
+import orjson
 import os
+import re
 import sys
+from random import uniform
 
-import my_model
+# Use uvloop when available, even if uvicorn is launched without --loop uvloop
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
 
 # Get the custom app path from environment variable
 # In Domino v6.1+, you can set a custom path like: /apps/<custom_path_name>/
 # Set this as an environment variable in your Domino webapp settings
 DOMINO_APP_PATH = os.getenv("DOMINO_APP_PATH", "")
 
+# Environment variables don't change after startup, so read them once
+_DOMINO_USER = os.getenv("DOMINO_USER", "not_set")
+_DOMINO_PROJECT_NAME = os.getenv("DOMINO_PROJECT_NAME", "not_set")
+_DOMINO_PROJECT_OWNER = os.getenv("DOMINO_PROJECT_OWNER", "not_set")
+DOMINO_ENABLE_DEBUG = os.getenv("DOMINO_ENABLE_DEBUG") == "1"
+
+# Remote model configuration for /remoteprediction
+_REMOTE_HOST = os.getenv("DOMINO_REMOTE_MODEL_HOST")
+_MODEL_ID = os.getenv("DOMINO_REMOTE_MODEL_ID")
+_ACCESS_TOKEN = os.getenv("DOMINO_REMOTE_MODEL_TOKEN") or None
+# Domino typically serves models on HTTPS 443
+_REMOTE_URL = (
+    f"https://{_REMOTE_HOST}:443/models/{_MODEL_ID}/latest/model"
+    if _REMOTE_HOST and _MODEL_ID
+    else None
+)
+# Domino model endpoints use the token as both user and password
+_REMOTE_AUTH = (_ACCESS_TOKEN, _ACCESS_TOKEN) if _ACCESS_TOKEN else None
+
+# Matches the /apps/<name> prefix Domino serves webapps under
+_APPS_RE = re.compile(r"^(/apps/[^/]+)")
+
 # Create FastAPI app instance with root_path if custom path is set
 app_config = {
     "title": "Domino FastAPI Webapp",
     "description": "A simple FastAPI application deployed as a Domino webapp",
     "version": "1.0.0",
+    # Serialize all JSON responses with orjson rather than the stdlib json module
+    "default_response_class": ORJSONResponse,
 }
 
 if DOMINO_APP_PATH:
@@ -47,60 +81,221 @@ app = FastAPI(**app_config)
 # Note: With root_path configured, FastAPI's default /docs should work correctly
 # No need to override it
 
+
+class WildcardCORSMiddleware:
+    """
+    Minimal pure-ASGI CORS middleware that allows any origin, method and header,
+    with credentials.
+
+    Mirrors Starlette's CORSMiddleware configured with allow_origins=["*"],
+    allow_methods=["*"], allow_headers=["*"] and allow_credentials=True: since
+    credentials are allowed, the Origin is always echoed rather than "*", and
+    preflights echo the requested headers. All other header bytes are built once here.
+    """
+
+    def __init__(self, app, max_age: int = 600):
+        self.app = app
+        # Responses differ by Origin even when none is sent, so caches must key on it
+        self.vary_origin = (b"vary", b"Origin")
+        self.allow_credentials = (b"access-control-allow-credentials", b"true")
+        self.preflight_headers = [
+            (b"vary", b"Origin, Access-Control-Request-Method, Access-Control-Request-Headers"),
+            (b"access-control-allow-methods", b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT, QUERY"),
+            (b"access-control-max-age", str(max_age).encode("latin-1")),
+            self.allow_credentials,
+            (b"content-type", b"text/plain; charset=utf-8"),
+            (b"content-length", b"2"),
+        ]
+        self.preflight_body = {"type": "http.response.body", "body": b"OK"}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        origin = request_method = request_headers = None
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                request_method = value
+            elif name == b"access-control-request-headers":
+                request_headers = value
+
+        if origin is not None and scope["method"] == "OPTIONS" and request_method is not None:
+            # A "*" allow-headers never covers Authorization, so echo the request's
+            headers = [(b"access-control-allow-origin", origin), *self.preflight_headers]
+            if request_headers is not None:
+                headers.append((b"access-control-allow-headers", request_headers))
+            await send({"type": "http.response.start", "status": 200, "headers": headers})
+            await send(self.preflight_body)
+            return
+
+        if origin is None:
+            cors_headers = (self.vary_origin,)
+        else:
+            # Browsers reject "*" with allow-credentials, so echo the origin
+            cors_headers = (
+                (b"access-control-allow-origin", origin),
+                self.allow_credentials,
+                self.vary_origin,
+            )
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                # Build a new list; the original may be shared by a reused Response
+                message["headers"] = [*message.get("headers", ()), *cors_headers]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
+
+
 # Add CORS middleware in case Domino needs it
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+app.add_middleware(WildcardCORSMiddleware)
+
+
+@app.on_event("startup")
+async def startup():
+    """Size the sync-endpoint thread pool and create a shared async HTTP client."""
+    # AnyIO defaults to 40 worker threads for sync code called from endpoints
+    anyio.to_thread.current_default_thread_limiter().total_tokens = int(
+        os.getenv("FASTAPI_THREAD_TOKENS", "200")
+    )
+    app.state.http = httpx.AsyncClient(
+        timeout=10,
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=100, max_connections=200),
+    )
 
 
-class RandomNumberRequest(BaseModel):
+@app.on_event("shutdown")
+async def shutdown():
+    """Close the shared async HTTP client."""
+    await app.state.http.aclose()
+
+
+class RandomNumberRequest(msgspec.Struct):
     """Payload for generating a random number."""
     start: float
     stop: float
 
 
-class PredictionRequest(BaseModel):
+class PredictionRequest(msgspec.Struct):
     """Request model for predictions."""
     data: RandomNumberRequest
 
 
-class PredictionResponse(BaseModel):
+class PredictionResponse(msgspec.Struct):
     """Response model for predictions."""
     prediction: Any
     metadata: Dict[str, Any]
 
+# /predict decodes and encodes with msgspec rather than FastAPI/Pydantic,
+# so its request and response schemas are documented for Swagger here
+PREDICT_OPENAPI = {
+    "requestBody": {
+        "required": False,
+        "content": {
+            "application/json": {
+                "schema": {
+                    "type": "object",
+                    "required": ["data"],
+                    "properties": {
+                        "data": {
+                            "type": "object",
+                            "required": ["start", "stop"],
+                            "properties": {
+                                "start": {"type": "number"},
+                                "stop": {"type": "number"},
+                            },
+                        }
+                    },
+                },
+                "example": {"data": {"start": 1, "stop": 100}},
+            }
+        },
+    },
+    "responses": {
+        "200": {
+            "description": "Successful Response",
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "type": "object",
+                        "required": ["prediction", "metadata"],
+                        "properties": {
+                            "prediction": {},
+                            "metadata": {"type": "object"},
+                        },
+                    }
+                }
+            },
+        }
+    },
+}
+
+# strict=False keeps the lax coercion Pydantic applied, e.g. "1" -> 1.0
+_decode_prediction_request = msgspec.json.Decoder(PredictionRequest, strict=False).decode
+_encode_json = msgspec.json.Encoder().encode
+
+# Response metadata to help identify where the /predict response is coming from
+_RESPONSE_METADATA = {
+    "server": "uvicorn",
+    "framework": "fastapi",
+    "deployment_type": "domino_webapp",
+    "request_received": True,
+    "model_function": "app.predict (inline)",
+}
+
+# Request body schema for /remoteprediction, documented for Swagger only;
+# the body is forwarded as-is without Pydantic validation
+REMOTE_PREDICTION_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {
+                "schema": {
+                    "type": "object",
+                    "required": ["data"],
+                    "properties": {"data": {"type": "object"}},
+                },
+                "example": {"data": {"start": 1, "stop": 100}},
+            }
+        },
+    }
+}
+
+
+# The / and /health bodies never change after startup, so build them once
+_ROOT_BYTES = orjson.dumps({
+    "message": "FastAPI app running in Domino",
+    "status": "healthy",
+    "python_version": sys.version,
+    "environment_vars": {
+        "DOMINO_USER": _DOMINO_USER,
+        "DOMINO_PROJECT_NAME": _DOMINO_PROJECT_NAME,
+    }
+})
+_ROOT_RESP = Response(content=_ROOT_BYTES, media_type="application/json")
 
-class RemotePredictionRequest(BaseModel):
-    """Request body for /remoteprediction; forwarded to the remote model."""
-    data: Dict[str, Any]
+_HEALTH_BYTES = orjson.dumps({"status": "healthy"})
+_HEALTH_RESP = Response(content=_HEALTH_BYTES, media_type="application/json")
 
 
 @app.get("/")
 async def root():
     """Root endpoint - health check and info."""
-    return {
-        "message": "FastAPI app running in Domino",
-        "status": "healthy",
-        "python_version": sys.version,
-        "environment_vars": {
-            "DOMINO_USER": os.getenv("DOMINO_USER", "not_set"),
-            "DOMINO_PROJECT_NAME": os.getenv("DOMINO_PROJECT_NAME", "not_set"),
-        }
-    }
+    return _ROOT_RESP
 
 
 @app.get("/health")
 async def health():
     """Health check endpoint."""
-    return {"status": "healthy"}
+    return _HEALTH_RESP
 
 
-@app.post("/remoteprediction")
-async def remote_prediction(request: RemotePredictionRequest):
+@app.post("/remoteprediction", openapi_extra=REMOTE_PREDICTION_OPENAPI)
+async def remote_prediction(request: Request):
     """
     Forward a prediction request to a remote Domino model.
 
@@ -110,53 +305,75 @@ async def remote_prediction(request: RemotePredictionRequest):
     where:
       - <domino_url> comes from DOMINO_REMOTE_MODEL_HOST
       - <model_id> comes from DOMINO_REMOTE_MODEL_ID
-    """
-    remote_host = os.getenv("DOMINO_REMOTE_MODEL_HOST")
-    model_id = os.getenv("DOMINO_REMOTE_MODEL_ID")
-    access_token = os.getenv("DOMINO_REMOTE_MODEL_TOKEN") or None
 
-    if not remote_host or not model_id:
+    The request body (`{"data": {...}}`) is forwarded unchanged and the remote
+    response body is streamed back without being parsed.
+    """
+    if _REMOTE_URL is None:
         raise HTTPException(
             status_code=500,
             detail="Remote model configuration missing; set DOMINO_REMOTE_MODEL_HOST and DOMINO_REMOTE_MODEL_ID.",
         )
 
-    # Build the remote URL; Domino typically serves models on HTTPS 443
-    remote_url = f"https://{remote_host}:443/models/{model_id}/latest/model"
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Request body must be valid JSON.")
 
-    # Build auth tuple if a token is provided; Domino model endpoints use token as both user and password
-    auth = (access_token, access_token) if access_token else None
+    if not isinstance(payload, dict) or "data" not in payload:
+        raise HTTPException(status_code=422, detail='Request body must be of the form {"data": {...}}.')
 
+    client = app.state.http
     try:
-        resp = requests.post(remote_url, json={"data": request.data}, timeout=10, auth=auth)
-    except requests.RequestException as exc:
+        resp = await client.send(
+            # request.json() cached the raw bytes; send them as-is rather than re-encoding
+            client.build_request(
+                "POST",
+                _REMOTE_URL,
+                content=await request.body(),
+                headers={"content-type": "application/json"},
+            ),
+            auth=_REMOTE_AUTH,
+            stream=True,
+        )
+    except httpx.RequestError as exc:
         raise HTTPException(
             status_code=502,
             detail=f"Error calling remote model: {exc}",
         )
 
     if resp.status_code >= 400:
+        await resp.aread()
+        await resp.aclose()
         raise HTTPException(
             status_code=resp.status_code,
             detail=f"Remote model returned error {resp.status_code}: {resp.text}",
         )
 
-    # Pass through the JSON response from the remote model
-    try:
-        return resp.json()
-    except ValueError:
-        # Remote model didn't return JSON
-        return {"raw_response": resp.text}
+    # Pass through the remote response body as-is; the raw stream keeps any
+    # content encoding, so forward that header too
+    headers = {}
+    content_encoding = resp.headers.get("content-encoding")
+    if content_encoding:
+        headers["content-encoding"] = content_encoding
+
+    return StreamingResponse(
+        resp.aiter_raw(),
+        status_code=resp.status_code,
+        media_type=resp.headers.get("content-type", "application/json"),
+        headers=headers,
+        background=BackgroundTask(resp.aclose),
+    )
 
 
-@app.post("/predict", response_model=PredictionResponse)
+@app.post("/predict", openapi_extra=PREDICT_OPENAPI)
 async def predict(
-    request: PredictionRequest,
+    request: Request,
     start: Optional[float] = None,
     stop: Optional[float] = None,
 ):
     """
-    Prediction endpoint that delegates to `my_model.predict`.
+    Prediction endpoint that mirrors the start/stop path of `my_model.predict`.
 
     You can generate a random number like in `model.py` in two ways:
 
@@ -165,53 +382,49 @@ async def predict(
     - Query parameters:
       `/predict?start=1&stop=100` with an (empty) or default body.
     """
-    # If query parameters are provided, prefer them (and document them clearly in Swagger)
-    if start is not None and stop is not None:
-        model_output = my_model.predict(start=start, stop=stop)
-    else:
-        # Run the model prediction using the same contract Domino uses:
-        # my_model.predict(**data)
-        model_output = my_model.predict(**request.data.dict())
-
-    # Add response metadata to help identify where the response is coming from
-    response_metadata = {
-        "server": "uvicorn",
-        "framework": "fastapi",
-        "deployment_type": "domino_webapp",
-        "request_received": True,
-        "model_function": "my_model.predict",
-    }
-
-    return PredictionResponse(
-        prediction=model_output,
-        metadata=response_metadata,
+    # If query parameters are provided, prefer them (and document them clearly in Swagger).
+    # Both paths end up with validated floats, so compute the prediction inline
+    # rather than going through my_model.predict's generic dispatch.
+    if start is None or stop is None:
+        body = await request.body()
+        if not body:
+            # Same 422 FastAPI raised for the missing required body
+            raise HTTPException(
+                status_code=422,
+                detail=[{"loc": ["body"], "msg": "Field required", "type": "missing"}],
+            )
+        try:
+            data = _decode_prediction_request(body).data
+        except msgspec.ValidationError as exc:
+            raise HTTPException(
+                status_code=422,
+                detail=[{"loc": ["body"], "msg": str(exc), "type": "value_error"}],
+            )
+        except msgspec.DecodeError as exc:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON body: {exc}")
+        start, stop = data.start, data.stop
+
+    return Response(
+        content=_encode_json(PredictionResponse(
+            prediction={"a_random_number": uniform(start, stop)},
+            metadata=_RESPONSE_METADATA,
+        )),
+        media_type="application/json",
     )
 
 
 def detect_root_path(request: Request) -> str:
     """Detect the root path from request headers or URL."""
-    # Check headers that Domino might set
-    x_forwarded_prefix = request.headers.get("x-forwarded-prefix", "")
-    x_script_name = request.headers.get("x-script-name", "")
-    
-    # Check scope for root_path (set by uvicorn)
-    root_path = request.scope.get("root_path", "")
-    
-    # Extract from URL if we're under /apps/
-    url_path = request.url.path
-    if "/apps/" in url_path:
-        parts = url_path.split("/")
-        app_index = parts.index("apps")
-        if app_index >= 0 and app_index + 1 < len(parts):
-            detected = "/" + "/".join(parts[:app_index + 2])
-            return detected.rstrip("/")
-    
-    # Return the first non-empty value found
-    for path in [x_forwarded_prefix, x_script_name, root_path]:
-        if path:
-            return path.rstrip("/")
-    
-    return ""
+    # Return the first non-empty value from headers Domino might set, or the
+    # root_path set by uvicorn
+    hget = request.headers.get
+    path = hget("x-forwarded-prefix") or hget("x-script-name") or request.scope.get("root_path")
+    if path:
+        return path.rstrip("/")
+
+    # Otherwise extract it from the URL if we're under /apps/
+    match = _APPS_RE.match(request.url.path)
+    return match.group(1) if match else ""
 
 
 @app.get("/info")
@@ -227,9 +440,9 @@ async def info(request: Request):
         "server": "uvicorn",
         "deployment": "Domino Webapp",
         "environment": {
-            "DOMINO_USER": os.getenv("DOMINO_USER", "not_set"),
-            "DOMINO_PROJECT_NAME": os.getenv("DOMINO_PROJECT_NAME", "not_set"),
-            "DOMINO_PROJECT_OWNER": os.getenv("DOMINO_PROJECT_OWNER", "not_set"),
+            "DOMINO_USER": _DOMINO_USER,
+            "DOMINO_PROJECT_NAME": _DOMINO_PROJECT_NAME,
+            "DOMINO_PROJECT_OWNER": _DOMINO_PROJECT_OWNER,
         },
         "request_info": {
             "base_url": base_url,
@@ -250,84 +463,89 @@ async def info(request: Request):
     }
 
 
+# Debug endpoints are only registered when DOMINO_ENABLE_DEBUG=1, keeping the
+# route table short in production
+if DOMINO_ENABLE_DEBUG:
+    @app.get("/debug/paths")
+    async def debug_paths(request: Request):
+        """Debug endpoint specifically for diagnosing path issues with /docs and /openapi.json."""
+        base_url = str(request.base_url).rstrip("/")
+
+        # Try to determine the base path
+        url_str = str(request.url)
+        path = request.url.path
+
+        # Extract the base path if we're under /apps/...
+        base_path = ""
+        if "/apps/" in path:
+            # Extract everything up to and including /apps/{id}/
+            parts = path.split("/")
+            app_index = parts.index("apps")
+            if app_index >= 0 and app_index + 1 < len(parts):
+                base_path = "/" + "/".join(parts[:app_index + 2])
+
+        return {
+            "message": "Path debugging information for /docs and /openapi.json",
+            "request_info": {
+                "full_url": url_str,
+                "path": path,
+                "base_url": base_url,
+                "detected_base_path": base_path,
+                "root_path": request.scope.get("root_path", "not_set"),
+                "script_name": request.scope.get("script_name", "not_set"),
+            },
+            "expected_urls": {
+                "openapi_json": f"{base_url}/openapi.json",
+                "docs": f"{base_url}/docs",
+                "redoc": f"{base_url}/redoc",
+            },
+            "if_base_path_detected": {
+                "openapi_json": f"{base_url}{base_path}/openapi.json" if base_path else "N/A",
+                "docs": f"{base_url}{base_path}/docs" if base_path else "N/A",
+            },
+            "headers": {
+                "x-forwarded-prefix": request.headers.get("x-forwarded-prefix", "not_present"),
+                "x-script-name": request.headers.get("x-script-name", "not_present"),
+                "host": request.headers.get("host", "not_present"),
+            }
+        }
 
 
-@app.get("/debug/paths")
-async def debug_paths(request: Request):
-    """Debug endpoint specifically for diagnosing path issues with /docs and /openapi.json."""
-    base_url = str(request.base_url).rstrip("/")
-    
-    # Try to determine the base path
-    url_str = str(request.url)
-    path = request.url.path
-    
-    # Extract the base path if we're under /apps/...
-    base_path = ""
-    if "/apps/" in path:
-        # Extract everything up to and including /apps/{id}/
-        parts = path.split("/")
-        app_index = parts.index("apps")
-        if app_index >= 0 and app_index + 1 < len(parts):
-            base_path = "/" + "/".join(parts[:app_index + 2])
-    
-    return {
-        "message": "Path debugging information for /docs and /openapi.json",
-        "request_info": {
-            "full_url": url_str,
-            "path": path,
-            "base_url": base_url,
-            "detected_base_path": base_path,
+    @app.get("/debug/headers")
+    async def debug_headers(request: Request):
+        """Debug endpoint to see all request headers - helps identify middleware."""
+        return {
+            "message": "Request headers received by FastAPI",
+            "headers": dict(request.headers),
+            "client_host": request.client.host if request.client else None,
+            "url": str(request.url),
+            "method": request.method,
+            "path": request.url.path,
+            "base_url": str(request.base_url),
             "root_path": request.scope.get("root_path", "not_set"),
-            "script_name": request.scope.get("script_name", "not_set"),
-        },
-        "expected_urls": {
-            "openapi_json": f"{base_url}/openapi.json",
-            "docs": f"{base_url}/docs",
-            "redoc": f"{base_url}/redoc",
-        },
-        "if_base_path_detected": {
-            "openapi_json": f"{base_url}{base_path}/openapi.json" if base_path else "N/A",
-            "docs": f"{base_url}{base_path}/docs" if base_path else "N/A",
-        },
-        "headers": {
-            "x-forwarded-prefix": request.headers.get("x-forwarded-prefix", "not_present"),
-            "x-script-name": request.headers.get("x-script-name", "not_present"),
-            "host": request.headers.get("host", "not_present"),
+            "script_name": request.scope.get("script_name", "not_set")
         }
-    }
 
 
-@app.get("/debug/headers")
-async def debug_headers(request: Request):
-    """Debug endpoint to see all request headers - helps identify middleware."""
-    return {
-        "message": "Request headers received by FastAPI",
-        "headers": dict(request.headers),
-        "client_host": request.client.host if request.client else None,
-        "url": str(request.url),
-        "method": request.method,
-        "path": request.url.path,
-        "base_url": str(request.base_url),
-        "root_path": request.scope.get("root_path", "not_set"),
-        "script_name": request.scope.get("script_name", "not_set")
-    }
-
-
-@app.post("/debug/echo")
-async def debug_echo(request: Request):
-    """Echo back the request body and headers for debugging."""
-    try:
-        body = await request.body()
-        body_text = body.decode('utf-8') if body else None
-    except Exception as e:
-        body_text = f"Error reading body: {str(e)}"
-    
-    return {
-        "message": "Echo endpoint - returns everything we receive",
-        "headers": dict(request.headers),
-        "body_raw": body_text,
-        "query_params": dict(request.query_params),
-        "path_params": dict(request.path_params),
-        "client": str(request.client) if request.client else None
-    }
-
+    @app.post("/debug/echo")
+    async def debug_echo(request: Request):
+        """Echo back the request body and headers for debugging."""
+        try:
+            body = await request.body()
+            if not body:
+                body_text = None
+            elif len(body) < 1_000_000:
+                body_text = body.decode('utf-8')
+            else:
+                body_text = f"<{len(body)} bytes, too large to echo>"
+        except Exception as e:
+            body_text = f"Error reading body: {str(e)}"
+
+        return {
+            "message": "Echo endpoint - returns everything we receive",
+            "headers": dict(request.headers),
+            "body_raw": body_text,
+            "query_params": dict(request.query_params),
+            "path_params": dict(request.path_params),
+            "client": str(request.client) if request.client else None
+        }
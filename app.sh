@@ -9,6 +9,26 @@
 PORT=${DOMINO_WEBAPP_PORT:-8888}
 HOST=${DOMINO_WEBAPP_HOST:-0.0.0.0}
 
+# One uvicorn worker process per available CPU by default (capped at 4, since each
+# worker holds its own copy of the app and model), so CPU-bound model code isn't
+# limited to a single core by the GIL; a larger backlog avoids dropped connections
+# during bursts
+CPUS=$(nproc 2>/dev/null || echo 1)
+# nproc ignores cgroup CPU quotas, so honour the container's cgroup v2 limit if set
+if [ -r /sys/fs/cgroup/cpu.max ]; then
+    read -r CPU_QUOTA CPU_PERIOD < /sys/fs/cgroup/cpu.max
+    if [ "$CPU_QUOTA" != "max" ] && [ "${CPU_PERIOD:-0}" -gt 0 ]; then
+        QUOTA_CPUS=$(( (CPU_QUOTA + CPU_PERIOD - 1) / CPU_PERIOD ))
+        if [ "$QUOTA_CPUS" -lt "$CPUS" ]; then
+            CPUS=$QUOTA_CPUS
+        fi
+    fi
+fi
+MAX_DEFAULT_WORKERS=4
+WORKERS=${UVICORN_WORKERS:-$(( CPUS < MAX_DEFAULT_WORKERS ? CPUS : MAX_DEFAULT_WORKERS ))}
+BACKLOG=${UVICORN_BACKLOG:-4096}
+LIMIT_CONCURRENCY=${UVICORN_LIMIT_CONCURRENCY:-1000}
+
 # Get the custom app path (e.g., /apps/my-fastapi-app or /apps/my-fastapi-app/)
 # Default to lowercase "fastapi" to follow URL path conventions
 DOMINO_APP_PATH=${DOMINO_APP_PATH:-fastapi}
@@ -16,6 +36,7 @@ DOMINO_APP_PATH=${DOMINO_APP_PATH:-fastapi}
 echo "Starting FastAPI application..."
 echo "Host: $HOST"
 echo "Port: $PORT"
+echo "Workers: $WORKERS"
 
 # Remote model configuration (for /remoteprediction endpoint)
 # DOMINO_REMOTE_MODEL_HOST defaults to the current host if not provided
@@ -55,7 +76,7 @@ if [ -n "$DOMINO_APP_PATH" ]; then
     export DOMINO_APP_PATH="$ROOT_PATH"
     
     # Run uvicorn with root_path - this ensures FastAPI generates correct URLs
-    uvicorn app:app --host "$HOST" --port "$PORT" --root-path "$ROOT_PATH" --log-level info
+    uvicorn app:app --host "$HOST" --port "$PORT" --root-path "$ROOT_PATH" --workers "$WORKERS" --backlog "$BACKLOG" --limit-concurrency "$LIMIT_CONCURRENCY" --loop uvloop --http httptools --log-level info
 else
     echo "Root Path: (not set)"
     echo ""
@@ -69,6 +90,6 @@ else
     echo ""
     
     # Run without root_path (will have issues with /docs)
-    uvicorn app:app --host "$HOST" --port "$PORT" --log-level info
+    uvicorn app:app --host "$HOST" --port "$PORT" --workers "$WORKERS" --backlog "$BACKLOG" --limit-concurrency "$LIMIT_CONCURRENCY" --loop uvloop --http httptools --log-level info
 fi
 
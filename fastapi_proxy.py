@@ -2,176 +2,302 @@
 FastAPI Proxy Module
 
 This module intercepts the Flask app creation and adds proxy functionality
-to route requests to a FastAPI/uvicorn server running on localhost.
+to route requests to a FastAPI app served by uvicorn in the same process.
 
 Since Domino's model_app.py cannot be modified, this module monkey-patches
 the Flask routes to proxy to FastAPI while maintaining backward compatibility.
 """
-import subprocess
+import asyncio
+import concurrent.futures
 import threading
 import time
-import requests
+import httpx
+import orjson
+import uvicorn
 import os
-from flask import request, jsonify
+from flask import Response, request
+from werkzeug.exceptions import HTTPException
 
 # Configuration for uvicorn/FastAPI server
 FASTAPI_HOST = os.environ.get("FASTAPI_HOST", "127.0.0.1")
 FASTAPI_PORT = int(os.environ.get("FASTAPI_PORT", "8000"))
 FASTAPI_URL = f"http://{FASTAPI_HOST}:{FASTAPI_PORT}"
+UVICORN_BACKLOG = int(os.environ.get("UVICORN_BACKLOG", "4096"))
+UVICORN_LIMIT_CONCURRENCY = int(os.environ.get("UVICORN_LIMIT_CONCURRENCY", "1000"))
+# Seconds to wait before retrying a failed uvicorn startup
+UVICORN_RETRY_INTERVAL = 30
+# Seconds start_uvicorn_server waits for the app to become ready before returning
+UVICORN_STARTUP_TIMEOUT = 5
 
-# Global variable to track if uvicorn is running
-_uvicorn_process = None
-_uvicorn_started = False
-_uvicorn_starting = False
+# Global variables to track the in-process uvicorn server. They only belong to
+# the process in _uvicorn_pid; a forked child must reset them (see _reset_after_fork)
+_uvicorn_pid = os.getpid()
+_uvicorn_server = None
+_uvicorn_loop = None
+_asgi_client = None
+# Lifespan run without a listener when uvicorn can't bind (see _serve_uvicorn)
+_uvicorn_lifespan = None
+# Held while the server is starting or running, so it starts once per process;
+# released again if startup fails so a later request can retry
+_uvicorn_start_lock = threading.Lock()
+# Earliest time (time.monotonic()) a failed startup may be retried
+_uvicorn_retry_at = 0.0
+# Set once this process's app lifespan startup has completed; until then (or if
+# it fails) Flask handles requests itself
+_uvicorn_ready = threading.Event()
+# Guards _reset_after_fork against concurrent requests in a new child
+_fork_reset_lock = threading.Lock()
+
+
+def _new_event_loop():
+    """Create the event loop for the uvicorn thread, preferring uvloop."""
+    try:
+        import uvloop
+    except ImportError:
+        return asyncio.new_event_loop()
+    return uvloop.new_event_loop()
+
+
+def _uvicorn_startup_failed():
+    """Stop the uvicorn loop and allow a later retry; called from the loop thread."""
+    global _uvicorn_retry_at
+    print("Falling back to direct Flask handling")
+    _uvicorn_loop.stop()
+    _uvicorn_retry_at = time.monotonic() + UVICORN_RETRY_INTERVAL
+    _uvicorn_start_lock.release()
+
+
+async def _wait_for_uvicorn_started():
+    """Mark the app ready once uvicorn has run lifespan startup and bound its port."""
+    while not _uvicorn_server.started:
+        await asyncio.sleep(0.01)
+    _uvicorn_ready.set()
+    print(f"FastAPI/uvicorn server started successfully on {FASTAPI_URL}")
+
+
+async def _serve_uvicorn():
+    """
+    Run the uvicorn server.
+
+    If uvicorn can't bind (e.g. another worker already owns the port), it has
+    already run the app's lifespan shutdown before exiting, so run lifespan
+    startup again without a listener and serve in-process requests only.
+    """
+    global _uvicorn_lifespan
+
+    watcher = asyncio.ensure_future(_wait_for_uvicorn_started())
+    try:
+        await _uvicorn_server.serve()
+    except SystemExit:
+        watcher.cancel()
+        if _uvicorn_server.lifespan.should_exit:
+            print("Error starting uvicorn server: application startup failed")
+            _uvicorn_startup_failed()
+            return
+
+        print(f"Warning: uvicorn could not listen on {FASTAPI_URL}; serving in-process requests only")
+        _uvicorn_lifespan = _uvicorn_server.config.lifespan_class(_uvicorn_server.config)
+        await _uvicorn_lifespan.startup()
+        if _uvicorn_lifespan.should_exit:
+            print("Error starting uvicorn server: application startup failed")
+            _uvicorn_startup_failed()
+            return
+        _uvicorn_ready.set()
+        print("FastAPI app started for in-process requests")
+    else:
+        # The server shut down and ran the app's lifespan shutdown
+        watcher.cancel()
+        _uvicorn_ready.clear()
+
+
+def _run_uvicorn_loop():
+    """Thread target: run the uvicorn server and in-process requests on one loop."""
+    asyncio.set_event_loop(_uvicorn_loop)
+    _uvicorn_loop.create_task(_serve_uvicorn())
+    _uvicorn_loop.run_forever()
 
 
 def start_uvicorn_server():
-    """Start uvicorn server in a background process."""
-    global _uvicorn_process, _uvicorn_started, _uvicorn_starting
+    """Start uvicorn server in a background thread of this process."""
+    global _uvicorn_server, _uvicorn_loop, _asgi_client, _uvicorn_retry_at
     
-    if _uvicorn_started or _uvicorn_starting:
+    if not _uvicorn_start_lock.acquire(blocking=False):
         return
     
-    _uvicorn_starting = True
-    
     try:
         print(f"Starting FastAPI/uvicorn server on {FASTAPI_HOST}:{FASTAPI_PORT}...")
-        # Start uvicorn as a subprocess
-        _uvicorn_process = subprocess.Popen(
-            [
-                "uvicorn",
-                "fastapi_app:app",
-                "--host", FASTAPI_HOST,
-                "--port", str(FASTAPI_PORT),
-                "--workers", "1",
-                "--log-level", "info"
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
+        # Import here to avoid circular imports (the app may import the model script)
+        import fastapi_app
+
+        # Run uvicorn in this process; the server and in-process requests share one
+        # event loop so the app's startup state is visible to both
+        config = uvicorn.Config(
+            fastapi_app.app,
+            host=FASTAPI_HOST,
+            port=FASTAPI_PORT,
+            http="httptools",
+            backlog=UVICORN_BACKLOG,
+            limit_concurrency=UVICORN_LIMIT_CONCURRENCY,
+            log_level="info",
         )
+        _uvicorn_server = uvicorn.Server(config)
+        _uvicorn_loop = _new_event_loop()
+
+        # Flask handlers call the ASGI app directly instead of going over TCP
+        _asgi_client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=fastapi_app.app),
+            base_url=FASTAPI_URL,
+        )
+
+        threading.Thread(target=_run_uvicorn_loop, daemon=True).start()
         
-        # Wait a moment for server to start
-        max_retries = 10
-        for i in range(max_retries):
-            time.sleep(0.5)
-            try:
-                response = requests.get(f"{FASTAPI_URL}/health", timeout=1)
-                if response.status_code == 200:
-                    _uvicorn_started = True
-                    _uvicorn_starting = False
-                    print(f"FastAPI/uvicorn server started successfully on {FASTAPI_URL}")
-                    return
-            except requests.exceptions.RequestException:
-                continue
-        
-        # If we get here, server didn't start properly
-        print(f"Warning: FastAPI server may not have started properly on {FASTAPI_URL}")
-        print("Will attempt to use it anyway, falling back to Flask if needed")
-        _uvicorn_started = True  # Allow attempts to use it
-        _uvicorn_starting = False
+        # Readiness is signalled from the loop thread once this process's app has
+        # completed lifespan startup; a TCP probe could be answered by another
+        # process's listener. An unlocked start lock means startup already failed
+        # and was reported from the loop thread.
+        if not _uvicorn_ready.wait(timeout=UVICORN_STARTUP_TIMEOUT) and _uvicorn_start_lock.locked():
+            print(f"Warning: FastAPI app not ready after {UVICORN_STARTUP_TIMEOUT}s")
+            print("Falling back to Flask until it is")
             
     except Exception as e:
         print(f"Error starting uvicorn server: {e}")
         print("Falling back to direct Flask handling")
-        _uvicorn_starting = False
+        _uvicorn_retry_at = time.monotonic() + UVICORN_RETRY_INTERVAL
+        _uvicorn_start_lock.release()
 
 
-def proxy_to_fastapi(path, method="GET", json_data=None):
-    """Proxy a request to the FastAPI server."""
-    global _uvicorn_started
-    
-    # Ensure uvicorn is started (non-blocking)
-    if not _uvicorn_started and not _uvicorn_starting:
+def _reset_after_fork():
+    """
+    Reset the uvicorn state inherited from a parent process and restart it here.
+
+    A forked child (e.g. a uwsgi worker forked after the app was created) copies
+    the loop, client and flags but not the thread running the loop, so requests
+    submitted to the copied loop would never run.
+    """
+    global _uvicorn_pid, _uvicorn_server, _uvicorn_loop, _asgi_client, _uvicorn_lifespan
+    global _uvicorn_start_lock, _uvicorn_ready, _fork_reset_lock, _uvicorn_retry_at
+
+    # The parent started (or was starting) the server if it held the start lock
+    was_started = _uvicorn_start_lock.locked()
+
+    _uvicorn_pid = os.getpid()
+    _uvicorn_server = None
+    _uvicorn_loop = None
+    _asgi_client = None
+    _uvicorn_lifespan = None
+    _uvicorn_start_lock = threading.Lock()
+    _uvicorn_retry_at = 0.0
+    _uvicorn_ready = threading.Event()
+    _fork_reset_lock = threading.Lock()
+
+    if was_started:
         threading.Thread(target=start_uvicorn_server, daemon=True).start()
-        # Give it a moment
-        time.sleep(0.5)
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _dispatch(coro, timeout):
+    """Run a coroutine on the uvicorn loop and wait for its result."""
+    future = asyncio.run_coroutine_threadsafe(coro, _uvicorn_loop)
+    try:
+        return future.result(timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        # Don't leave the abandoned request running on the loop
+        future.cancel()
+        raise
+
+
+def proxy_to_fastapi(path, method="GET", json_data=None):
+    """Dispatch a request to the FastAPI app in-process."""
+    # Forks that bypass os.register_at_fork hooks still need their own server
+    if _uvicorn_pid != os.getpid():
+        if _fork_reset_lock.acquire(blocking=False):
+            if _uvicorn_pid != os.getpid():
+                _reset_after_fork()
+            else:
+                _fork_reset_lock.release()
+        return None
+
+    # uvicorn is started when the Flask app is patched; until it is ready,
+    # fall back to Flask rather than waiting
+    if not _uvicorn_ready.is_set():
+        # Retry in the background if startup failed (or never ran in this process)
+        if not _uvicorn_start_lock.locked() and time.monotonic() >= _uvicorn_retry_at:
+            threading.Thread(target=start_uvicorn_server, daemon=True).start()
+        return None
     
     try:
-        url = f"{FASTAPI_URL}{path}"
         if method == "POST":
-            response = requests.post(url, json=json_data, timeout=30)
+            # Encode with orjson here rather than letting httpx use the stdlib json module
+            if json_data is None:
+                request_kwargs = {}
+            else:
+                request_kwargs = {
+                    "content": orjson.dumps(json_data),
+                    "headers": {"content-type": "application/json"},
+                }
+            response = _dispatch(_asgi_client.post(path, **request_kwargs), timeout=30)
         else:
-            response = requests.get(url, timeout=10)
+            response = _dispatch(_asgi_client.get(path), timeout=10)
         
-        return jsonify(response.json()), response.status_code
-    except requests.exceptions.ConnectionError:
-        # If connection fails, return None to fall back to Flask
-        return None
+        # Pass the FastAPI response body through as-is instead of re-encoding it
+        return Response(
+            response.content,
+            status=response.status_code,
+            content_type=response.headers.get("content-type", "application/json"),
+        )
     except Exception as e:
         print(f"Error proxying to FastAPI: {e}")
         return None
 
 
+# Domino model routes that are proxied to FastAPI, as (path, method)
+_PROXIED_ROUTES = (
+    ('/model', 'POST'),
+    ('/health', 'GET'),
+    ('/version', 'GET'),
+)
+
+
+def _make_patch(path, method, original):
+    """Build a view function that proxies to FastAPI and falls back to `original`."""
+    def patched():
+        # Try to proxy to FastAPI first
+        try:
+            json_data = request.get_json() if method == 'POST' and request.is_json else None
+            result = proxy_to_fastapi(path, method=method, json_data=json_data)
+            if result is not None:
+                return result
+        except Exception as e:
+            print(f"Error in FastAPI proxy, falling back to Flask: {e}")
+
+        # Fallback to original Flask handler
+        return original()
+
+    return patched
+
+
 def patch_flask_app(app, config, model_app_utils):
     """
     Monkey-patch the Flask app routes to proxy to FastAPI.
     This function wraps the original route handlers.
     """
-    # Find endpoints and store original handlers
-    endpoints_to_patch = {}
-    
-    for rule in app.url_map.iter_rules():
+    # Resolve each route's endpoint directly instead of scanning every rule.
+    # Only patch the literal rule: a catch-all like /<path:p> would also match,
+    # but its view takes arguments the zero-argument patched view can't accept.
+    adapter = app.url_map.bind('')
+    for path, method in _PROXIED_ROUTES:
+        try:
+            rule, _ = adapter.match(path, method=method, return_rule=True)
+        except HTTPException:
+            continue
+        if rule.rule != path:
+            continue
         endpoint = rule.endpoint
-        if rule.rule == '/model' and 'POST' in rule.methods:
-            endpoints_to_patch['model'] = endpoint
-        elif rule.rule == '/health' and 'GET' in rule.methods:
-            endpoints_to_patch['health'] = endpoint
-        elif rule.rule == '/version' and 'GET' in rule.methods:
-            endpoints_to_patch['version'] = endpoint
-    
-    # Patch /model route
-    if 'model' in endpoints_to_patch:
-        endpoint = endpoints_to_patch['model']
-        original_model = app.view_functions[endpoint]
-        
-        def patched_model():
-            # Try to proxy to FastAPI first
-            try:
-                json_data = request.get_json() if request.is_json else None
-                result = proxy_to_fastapi('/model', method='POST', json_data=json_data)
-                if result is not None:
-                    return result
-            except Exception as e:
-                print(f"Error in FastAPI proxy, falling back to Flask: {e}")
-            
-            # Fallback to original Flask handler
-            return original_model()
-        
-        app.view_functions[endpoint] = patched_model
+        app.view_functions[endpoint] = _make_patch(path, method, app.view_functions[endpoint])
     
-    # Patch /health route
-    if 'health' in endpoints_to_patch:
-        endpoint = endpoints_to_patch['health']
-        original_health = app.view_functions[endpoint]
-        
-        def patched_health():
-            try:
-                result = proxy_to_fastapi('/health', method='GET')
-                if result is not None:
-                    return result
-            except Exception as e:
-                print(f"Error in FastAPI proxy, falling back to Flask: {e}")
-            return original_health()
-        
-        app.view_functions[endpoint] = patched_health
-    
-    # Patch /version route
-    if 'version' in endpoints_to_patch:
-        endpoint = endpoints_to_patch['version']
-        original_version = app.view_functions[endpoint]
-        
-        def patched_version():
-            try:
-                result = proxy_to_fastapi('/version', method='GET')
-                if result is not None:
-                    return result
-            except Exception as e:
-                print(f"Error in FastAPI proxy, falling back to Flask: {e}")
-            return original_version()
-        
-        app.view_functions[endpoint] = patched_version
-    
-    # Start uvicorn in background
+    # Start uvicorn in background as soon as the app exists, before any request arrives
     threading.Thread(target=start_uvicorn_server, daemon=True).start()
 
 
@@ -202,109 +328,17 @@ def patch_make_model_app():
     
     # Replace the function
     model_app.make_model_app = patched_make_model_app
+    print("FastAPI proxy: Successfully patched model_app.make_model_app")
 
 
-# Use multiple strategies to ensure patching works regardless of import order
-import sys
-import importlib.util
-import importlib.machinery
-
-
-class FastAPIProxyImportHook:
-    """
-    Import hook that automatically patches model_app.make_model_app
-    when model_app is imported, regardless of import order.
-    """
-    def find_spec(self, name, path, target=None):
-        if name == 'model_app':
-            # Find the spec for model_app
-            spec = importlib.util.find_spec(name, path)
-            if spec is not None and spec.loader is not None:
-                # Wrap the loader to patch after module is loaded
-                original_loader = spec.loader
-                
-                class PatchedLoader:
-                    def __init__(self, original):
-                        self.original = original
-                    
-                    def create_module(self, spec):
-                        if hasattr(self.original, 'create_module'):
-                            return self.original.create_module(spec)
-                        return None
-                    
-                    def exec_module(self, module):
-                        # Execute the module first
-                        if hasattr(self.original, 'exec_module'):
-                            self.original.exec_module(module)
-                        elif hasattr(self.original, 'load_module'):
-                            # For older Python versions
-                            self.original.load_module(module.__name__)
-                        
-                        # Patch after module is loaded
-                        try:
-                            patch_make_model_app()
-                            print("FastAPI proxy: Successfully auto-patched model_app.make_model_app via import hook")
-                        except Exception as e:
-                            print(f"FastAPI proxy: Warning - could not patch model_app: {e}")
-                            print("Application will run in Flask-only mode.")
-                
-                # Replace the loader
-                spec.loader = PatchedLoader(original_loader)
-            return spec
-        return None
-
-
-# Strategy 1: Register import hook (works if fastapi_proxy is imported before model_app)
-_hook_registered = False
-for hook in sys.meta_path:
-    if isinstance(hook, FastAPIProxyImportHook):
-        _hook_registered = True
-        break
-
-if not _hook_registered:
-    sys.meta_path.insert(0, FastAPIProxyImportHook())
-    print("FastAPI proxy: Import hook registered - will auto-patch model_app when imported")
-
-# Strategy 2: Patch immediately if model_app is already imported
+# Patch model_app as soon as this module is imported. If this module is imported
+# before model_app is importable (e.g. via fastapi_proxy.pth), the model script's
+# explicit patch_make_model_app() call covers it later.
 try:
-    if 'model_app' in sys.modules:
-        patch_make_model_app()
-        print("FastAPI proxy: Successfully patched already-imported model_app.make_model_app")
+    patch_make_model_app()
+except ImportError as e:
+    print(f"FastAPI proxy: model_app not available yet ({e})")
+    print("Call fastapi_proxy.patch_make_model_app() from the model script to patch it later.")
 except Exception as e:
-    pass  # Silent fail, will try other strategies
-
-# Strategy 3: Lazy patching - patch make_model_app when it's first accessed
-# This works even if model_app was imported before fastapi_proxy
-try:
-    import model_app
-    if not hasattr(model_app.make_model_app, '_fastapi_patched'):
-        # Store the original function
-        _original_make_model_app = model_app.make_model_app
-        _lazy_patch_done = False
-        
-        def lazy_patched_make_model_app(config):
-            global _lazy_patch_done
-            # Patch on first call if not already done
-            if not _lazy_patch_done:
-                try:
-                    # Do the actual patching
-                    patch_make_model_app()
-                    _lazy_patch_done = True
-                    print("FastAPI proxy: Successfully lazy-patched model_app.make_model_app on first call")
-                except Exception as e:
-                    print(f"FastAPI proxy: Warning - could not patch: {e}")
-                    # If patching fails, just use original
-                    return _original_make_model_app(config)
-            
-            # Now call the patched function (which will be model_app.make_model_app after patching)
-            return model_app.make_model_app(config)
-        
-        model_app.make_model_app = lazy_patched_make_model_app
-        print("FastAPI proxy: Set up lazy patching for model_app.make_model_app")
-except (ImportError, AttributeError):
-    # model_app not available yet, import hook will handle it
-    pass
-except Exception as e:
-    print(f"FastAPI proxy: Warning - could not set up lazy patching: {e}")
+    print(f"FastAPI proxy: Warning - could not patch model_app: {e}")
     print("Application will run in Flask-only mode.")
-
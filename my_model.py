@@ -6,19 +6,49 @@ When publishing your model in Domino, specify:
 - Script: my_model.py (or the path to this file)
 - Function: predict
 """
-import random
+from random import uniform as _uniform  # Bound once to skip the attribute lookup per call
 
 import fastapi_proxy  # Required: This enables FastAPI proxy functionality
 
+# Patch explicitly as well, in case fastapi_proxy was first imported before
+# model_app was importable; this is a no-op if it is already patched
+try:
+    fastapi_proxy.patch_make_model_app()
+except ImportError:
+    # Not running under Domino's model harness (e.g. imported by the webapp)
+    pass
+except Exception as e:
+    print(f"FastAPI proxy: Warning - could not patch model_app: {e}")
+    print("Application will run in Flask-only mode.")
+
 # Your model imports here
 # import numpy as np
 # import pandas as pd
 # from your_model_library import load_model, etc.
 
+# NumPy is optional; it is only used to generate batches of random numbers
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 def random_number(start, stop):
     """Generate a random number between start and stop (inclusive of range ends)."""
-    return random.uniform(start, stop)
+    return _uniform(start, stop)
+
+
+def random_numbers(start, stop, n):
+    """Generate a list of n random numbers between start and stop."""
+    if n > 1 and np is not None:
+        # One vectorized call instead of n Python-level calls
+        return (np.random.random(n) * (stop - start) + start).tolist()
+    return [_uniform(start, stop) for _ in range(n)]
+
+
+def _predict_range(start: float, stop: float) -> dict:
+    """Fast path for predict: a random number between two already-typed floats."""
+    return {"a_random_number": _uniform(start, stop)}
 
 
 def predict(data=None, **kwargs):
@@ -53,6 +83,19 @@ def predict(data=None, **kwargs):
         
         Request: {"data": ""}  # This will cause an error - use {} instead!
     """
+    # Fast path: Domino's usual call, predict(start=..., stop=...)
+    if data is None and "start" in kwargs and "stop" in kwargs:
+        try:
+            return _predict_range(float(kwargs["start"]), float(kwargs["stop"]))
+        except (TypeError, ValueError):
+            # Fall back to template behavior if inputs are invalid
+            pass
+
+    return _predict_fallback(data, kwargs)
+
+
+def _predict_fallback(data, kwargs):
+    """Generic handling for predict() calls that don't hit the start/stop fast path."""
     # When Domino unpacks the data dict, it comes as kwargs
     # If data was passed positionally (shouldn't happen with Domino's setup),
     # use it instead
@@ -76,7 +119,7 @@ def predict(data=None, **kwargs):
             # Fall back to template behavior if inputs are invalid
             pass
         else:
-            return {"a_random_number": random_number(start_val, stop_val)}
+            return _predict_range(start_val, stop_val)
     
     # Handle empty data case
     if not actual_data or (isinstance(actual_data, dict) and len(actual_data) == 0):